@@ -186,19 +186,20 @@ def domain_float_tf(bins, precision, domain=None):
     """
     if domain == None:
         domain = [
-            -tf.math.sqrt(2 * np.pi * 2 ** precision) / 2,
-            tf.math.sqrt(2 * np.pi * 2 ** precision) / 2,
+            -float(np.sqrt(2 * np.pi * 2 ** precision)) / 2,
+            float(np.sqrt(2 * np.pi * 2 ** precision)) / 2,
         ]
     a, b = domain
     base = 1 / 2 ** precision
 
+    # The bit weights are fixed by precision, so build them in numpy and let them
+    # enter the graph as one constant instead of a range/pow op chain per call
     v = tf.fill([bins.shape[0]], a)
-    idxs = tf.range(precision, dtype=tf.float32)
-    mult = 2**idxs * base * (b - a)
+    mult = tf.constant(2.0**np.arange(precision) * base, dtype=tf.float32) * (b - a)
     adder = tf.math.multiply(bins, mult)
     adder = tf.math.reduce_sum(adder, axis=1)
     v += adder
-    
+
     return v
 
 def domain_bin(v, precision, domain=None, lendian=False):
@@ -280,8 +281,8 @@ def domain_bin_tf(z, precision, domain=None):
     """
     if domain == None:
         domain = [
-            -tf.math.sqrt(2 * np.pi * 2 ** precision) / 2,
-            tf.math.sqrt(2 * np.pi * 2 ** precision) / 2,
+            -float(np.sqrt(2 * np.pi * 2 ** precision)) / 2,
+            float(np.sqrt(2 * np.pi * 2 ** precision)) / 2,
         ]
 
     v = tf.identity(z)
@@ -20,20 +20,39 @@ import matplotlib.pyplot as plt
 import cirq
 import scipy.stats
 
-#Define IQP circuit
-# H tensor N U tensor N H tensor N on |0> tensor N
 
-N=4 #number of modes
+def build_iqp_circuit(N=4, rng=None):
+    """
+    Build the IQP circuit H^N U H^N acting on |0>^N.
 
-q0, q1, q2, q3 = [cirq.GridQubit(i, 0) for i in range(N)]
+    Deferred to a function (rather than run at import time) so importing this
+    module is cheap and the random unitary draw is reproducible via rng.
 
-circuit=cirq.Circuit()
-#circuit.append([cirq.H(q0),cirq.H(q1), cirq.H(q2), cirq.H(q3), cirq.testing.random_unitary(dim=N), cirq.H(q0),cirq.H(q1), cirq.H(q2), cirq.H(q3)])
-U=np.array(scipy.stats.unitary_group.rvs(N))
-print(U)
-circuit.append([cirq.H(q0),cirq.H(q1), cirq.H(q2), cirq.H(q3), cirq.MatrixGate(U), cirq.H(q0),cirq.H(q1), cirq.H(q2), cirq.H(q3)])
+    Args:
+        - N (int, optional): number of modes
+        - rng (optional): random_state forwarded to scipy's unitary_group.rvs,
+            pass a seed or np.random.Generator for a reproducible unitary
 
-print(circuit) #test
-#Run algs on this prob distribution
+    Returns:
+        - (cirq.Circuit): the IQP circuit
+        - (NDArray[N, N]): the random unitary sandwiched between the Hadamard layers
+    """
+    qubits = [cirq.GridQubit(i, 0) for i in range(N)]
 
-#Performance metrics (plots, convergence...etc)
\ No newline at end of file
+    circuit = cirq.Circuit()
+    #circuit.append([cirq.H(q) for q in qubits] + [cirq.testing.random_unitary(dim=N)] + [cirq.H(q) for q in qubits])
+    U = np.array(scipy.stats.unitary_group.rvs(N, random_state=rng))
+    circuit.append([cirq.H(q) for q in qubits] + [cirq.MatrixGate(U)] + [cirq.H(q) for q in qubits])
+
+    return circuit, U
+
+
+if __name__ == "__main__":
+    #Define IQP circuit
+    # H tensor N U tensor N H tensor N on |0> tensor N
+    circuit, U = build_iqp_circuit(N=4)
+    print(U)
+    print(circuit) #test
+    #Run algs on this prob distribution
+
+    #Performance metrics (plots, convergence...etc)
@@ -8,6 +8,7 @@ import tensorflow_probability as tfp
 import cirq
 import sympy
 import collections
+import functools
 import random
 
 from cv_ops import PositionOp, MomentumOp
@@ -16,6 +17,58 @@ from cv_utils import domain_float_tf, domain_bin_tf
 
 RWResult = collections.namedtuple("RWResult", ['target_log_prob', 'log_acceptance_correction'])
 
+@functools.lru_cache(maxsize=8)
+def generate_circuit(target_log_prob_fn, r, num_vars, precision):
+    """
+    Generate the trotterized circuit for the given problem shape.
+
+    Cached on (target_log_prob_fn, r, num_vars, precision) so that repeated kernel
+    instantiations reuse the symbolic circuit instead of rebuilding it. Reuse
+    requires passing the same callable object (chain restarts, re-instantiating a
+    kernel for the same problem); a sweep that builds a fresh closure per point
+    misses every time, which is why the cache is bounded. The symbols are created
+    inside the cached call so the returned circuit and parameter list stay
+    consistent with each other.
+
+    Args:
+        - target_log_prob_fn (Callable): the function to optimize
+        - r (int): the number of trotter repetitions
+        - num_vars (int): the number of variables that the function is of
+        - precision (int): number of qubits to use to represent each variable
+
+    Returns:
+        - (cirq.Circuit): the trotterized circuit
+        - (list): the symbols used in the trotterized circuit
+    """
+    qubits = [[cirq.GridQubit(i, j) for j in range(precision)] for i in range(num_vars)]
+    eta = sympy.symbols('eta')
+    lam = sympy.symbols('lam')
+    xs = sympy.symbols('xs0:%d'%(num_vars*precision))
+    flat_qubits = [qubit for qs in qubits for qubit in qs]
+    circuit = cirq.Circuit(cirq.Moment(cirq.X(qubit)**xs[k] for k, qubit in enumerate(flat_qubits)))
+    # Fragments reused across trotter steps: they depend only on the qubit layout
+    # and the shared eta/lam symbols, not on the step index
+    potential = tfq.util.exponential(operators = [target_log_prob_fn([PositionOp(qs) for qs in qubits]).op], coefficients = [eta])
+    qft = [centeredQFT(qs) for qs in qubits]
+    iqft = [centeredQFT(qs, inverse=True) for qs in qubits]
+    # The per-register momentum terms act on disjoint qubits, so their exponentials
+    # factor and one summed operator yields the same unitary as one sub-circuit each
+    momentum_sq = sum(((1/2) * MomentumOp(qs).op ** 2 for qs in qubits), cirq.PauliSum())
+    kinetic = tfq.util.exponential(operators = [momentum_sq], coefficients = [lam])
+    x_first = [cirq.X(qs[0]) for qs in qubits]
+    for _ in range(r):
+        circuit += potential
+        # Convert between position and momentum space
+        circuit += qft
+        circuit += kinetic
+        circuit += iqft
+    # Momentum flip
+    circuit += qft
+    circuit += x_first
+    circuit += iqft
+
+    return circuit, list(xs) + [eta] + [lam]
+
 class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
     """
     The core transition kernel for the QDHMC algorithm.
@@ -36,16 +89,20 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
         - lam_sig (float): the standard deviation of the lambda parameter
     """
 
-    def __init__(self, target_log_prob, precision, t, r, num_vars):
+    def __init__(self, target_log_prob, precision, t, r, num_vars, num_chains=1):
         """
         Initialize member variables.
 
         Args:
-            - target_lob_prob (Callable): the function to optimize
+            - target_lob_prob (Callable): the function to optimize; called with a list
+                indexed per variable (x[i] is variable i), so the same explicitly
+                indexed functions that work on PositionOps also broadcast over chains
             - precision (int): number of qubits to use to represent each variable
             - t (float): the trotterized time to simualte
             - r (int): the number of trotter repetitions to do
             - num_vars (int): the number of variables that the function is of
+            - num_chains (int): the number of chains to run in parallel; for more than
+                one chain the state has shape [num_chains, num_vars]
 
         Returns:
             - None
@@ -55,15 +112,13 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
             precision = precision,
             t = t,
             r = r,
-            num_vars = num_vars
+            num_vars = num_vars,
+            num_chains = num_chains
         )
         self.sample = tfq.layers.Sample()
         self.qubits = [[cirq.GridQubit(i, j) for j in range(self.precision)] for i in range(num_vars)]
-        eta = sympy.symbols('eta')
-        lam = sympy.symbols('lam')
-        xs = sympy.symbols('xs0:%d'%(num_vars*precision))
-        self.trotterized_circuit = self.generate_circuit(self.r, xs, eta, lam)
-        self.params = list(xs) + [eta] + [lam]
+        self.trotterized_circuit, self.params = generate_circuit(target_log_prob, self.r, self.num_vars, self.precision)
+        self.dtype = tf.float32
         self.eta_mu = 0.0
         self.lam_mu = 0.0
         self.eta_sig = 1.0
@@ -89,54 +144,39 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
     def num_vars(self):
         return self._parameters['num_vars']
 
+    @property
+    def num_chains(self):
+        return self._parameters['num_chains']
+
     @property
     def is_calibrated(self):
         return False
 
-    def generate_circuit(self, r, xs, eta, lam):
-        """
-        Generate the trotterized circuit.
-
-        Args:
-            - r (int): the number of trotter repetitions
-            - xs (list): the parameters to initialize a given bitstring
-            - eta (list): the parameters representing eta
-            - lam (list): the parameters representing lambda
-
-        Returns:
-            - (cirq.Circuit): the trotterized circuit
-        """
-        circuit = cirq.Circuit()
-        for i, qubits in enumerate(self.qubits):
-            for j, qubit in enumerate(qubits):
-                circuit += cirq.X(qubit)**xs[i * self.precision + j]
-        for _ in range(r):
-            circuit += tfq.util.exponential(operators = [self.target_log_prob_fn([PositionOp(qubits) for qubits in self.qubits]).op], coefficients = [eta])
-            # Convert between position and momentum space
-            circuit += [centeredQFT(qubits) for qubits in self.qubits]
-            circuit += [tfq.util.exponential(operators = [(1/2) * MomentumOp(qubits).op ** 2], coefficients = [lam]) for qubits in self.qubits]
-            circuit += [centeredQFT(qubits, inverse=True) for qubits in self.qubits]
-        # Momentum flip
-        circuit += [centeredQFT(qubits) for qubits in self.qubits]
-        circuit += [cirq.X(qubits[0]) for qubits in self.qubits]
-        circuit += [centeredQFT(qubits, inverse=True) for qubits in self.qubits]
-
-        return circuit
-
+    @tf.function
     def one_step(self, current_state, previous_kernel_results, seed=None):
         """
         Generate the next proposal.
 
-        Randomly selects the eta and lambda parameters and parameterizes the trotterized 
+        Randomly selects the eta and lambda parameters and parameterizes the trotterized
         circuit with them. Converts the current state and encodes it to the circuit. The
         circuit is then simulated and the output is converted back into a float and returned.
 
         The unusual formatting and usage of certain functions is to ensure it is compatible with
-        all TF graphing techniques.
+        all TF graphing techniques. The whole step is wrapped in tf.function so the per-op
+        dispatch overhead collapses into a single graph call; traces are cached per state
+        shape/dtype. XLA (jit_compile=True) is not used because the TFQ simulation ops do
+        not provide XLA kernels.
+
+        The target log-prob is evaluated exactly once per proposal. The evaluation cannot
+        be recovered from the trotterized evolution itself: the circuit only embeds the
+        target as a symbolic operator, and the Metropolis-Hastings correction needs the
+        exact log-prob at the sampled point, not an expectation under the proposal
+        wavefunction.
 
         Args:
-            - current_state (float): the current parameters of the distribution
-            - previous_kernel_results (RWResult): tuple that contains the information from the 
+            - current_state (tensor): the current parameters of the distribution, with
+                shape [num_vars] for a single chain or [num_chains, num_vars] otherwise
+            - previous_kernel_results (RWResult): tuple that contains the information from the
                 previous iteration
             - seed (int, optional): set the random seed (note that it is not used in the sampling
                 from the circuit, so it will not ensure replicatability)
@@ -144,28 +184,38 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
         Returns:
             - (RWResult): the next proposal
         """
-        eta = tf.random.normal(shape=[1], mean=self.eta_mu, stddev=self.eta_sig, seed=seed)
+        eta = tf.random.normal(shape=[self.num_chains, 1], mean=self.eta_mu, stddev=self.eta_sig, seed=seed)
         eta *= self.t / self.r
-        lam = tf.random.normal(shape=[1], mean=self.lam_mu, stddev=self.lam_sig, seed=seed)
+        lam = tf.random.normal(shape=[self.num_chains, 1], mean=self.lam_mu, stddev=self.lam_sig, seed=seed)
         lam *= self.t / self.r
-        
-        bin_vals = domain_bin_tf(current_state, precision=self.precision)
-        bin_vals = tf.reshape(bin_vals, [bin_vals.shape[0] * bin_vals.shape[1]])
-        bin_vals = tf.cast(bin_vals, tf.float32)
 
-        values = tf.concat([bin_vals, eta, lam], axis=0)
+        bin_vals = domain_bin_tf(tf.reshape(current_state, [self.num_chains * self.num_vars]), precision=self.precision)
+        bin_vals = tf.reshape(bin_vals, [self.num_chains, self.num_vars * self.precision])
+        bin_vals = tf.cast(bin_vals, self.dtype)
+
+        values = tf.concat([bin_vals, eta, lam], axis=1)
         circuit_output = self.sample(self.trotterized_circuit, \
-            symbol_names=self.params, symbol_values=[values], repetitions=1).to_tensor()[0][0]
-        bitstrings = tf.convert_to_tensor([circuit_output[i * self.precision : i * self.precision + self.precision] for i in range(self.num_vars)], dtype=tf.float32)
+            symbol_names=self.params, symbol_values=values, repetitions=1).to_tensor()
+        circuit_output = tf.ensure_shape(circuit_output, [self.num_chains, 1, self.num_vars * self.precision])
+        circuit_output = tf.squeeze(circuit_output, axis=1)
+        bitstrings = tf.reshape(tf.cast(circuit_output, self.dtype), [self.num_chains * self.num_vars, self.precision])
 
         next_state_list = domain_float_tf(bitstrings, self.precision)
         next_state = tf.reshape(next_state_list, current_state.shape)
-        next_state = tf.cast(next_state, dtype=tf.float32)
-
-        next_target_log_prob = self.target_log_prob_fn(next_state)
+        # Trace-time guard: the cast (and its copy) is only emitted when the chain
+        # state dtype actually differs from the kernel dtype
+        if next_state.dtype != self.dtype:
+            next_state = tf.cast(next_state, dtype=self.dtype)
+
+        # Unstack along the variable axis so x[i] means variable i (matching the
+        # PositionOp call at circuit-build time), with each entry carrying the chains
+        next_target_log_prob = self.target_log_prob_fn(tf.unstack(next_state, axis=-1))
         
-        new_kernel_results = previous_kernel_results._replace(
-            target_log_prob = next_target_log_prob)
+        # Construct the namedtuple directly rather than via _replace, which routes
+        # every update through a kwargs dict on each of the millions of MCMC steps
+        new_kernel_results = RWResult(
+            target_log_prob = next_target_log_prob,
+            log_acceptance_correction = previous_kernel_results.log_acceptance_correction)
 
         return next_state, new_kernel_results
 
@@ -180,8 +230,8 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
             - (RWResult): the bootstrapped proposal
         """
         kernel_results = RWResult(
-            target_log_prob = self.target_log_prob_fn(init_state),
-            log_acceptance_correction = tf.convert_to_tensor(0.0, dtype=tf.float32)
+            target_log_prob = self.target_log_prob_fn(tf.unstack(init_state, axis=-1)),
+            log_acceptance_correction = tf.zeros(tf.shape(init_state)[:-1], dtype=tf.float32)
         )
         return kernel_results
 
@@ -193,15 +243,17 @@ class HMC(object):
     Attributes:
         - precision (int): number of qubits to represent each variable with
         - num_vars (int): number of variables in the function
+        - num_chains (int): number of chains run in parallel
         - kernel (mcmc object): type of optimization to be used
     """
 
-    def __init__(self, target_log_prob, num_vars, precision, kernel_type="classical", step_size=1.0, steps=3, t=None, r=None):
+    def __init__(self, target_log_prob, num_vars, precision, kernel_type="classical", step_size=1.0, steps=3, t=None, r=None, num_chains=1):
         """
         Initialize member variables.
 
         Args:
-            - target_lob_prob (Callable): the function to optimize
+            - target_lob_prob (Callable): the function to optimize, written with explicit
+                per-variable indexing (x[i] is variable i) as described in the README
             - num_vars (int): the number of variables that the function is of
             - precision (int): number of qubits to use to represent each variable
             - kernel_type (str): whether to use classical or quantum HMC
@@ -209,21 +261,41 @@ class HMC(object):
             - steps (int): the number of leapfrog steps for the classical integration
             - t (float): the trotterized time to simualte
             - r (int): the number of trotter repetitions to do
+            - num_chains (int): the number of chains to run in parallel
 
         Returns:
             - None
         """
         self.precision = precision
         self.num_vars = num_vars
+        self.num_chains = num_chains
         if kernel_type != "classical":
-            self.kernel = tfp.mcmc.MetropolisHastings(QDHMCKernel(target_log_prob, precision, t, r, num_vars))
+            self.kernel = tfp.mcmc.MetropolisHastings(QDHMCKernel(target_log_prob, precision, t, r, num_vars, num_chains))
         else:
             self.kernel = tfp.mcmc.HamiltonianMonteCarlo(target_log_prob_fn=target_log_prob, num_leapfrog_steps=steps, step_size=step_size)
+        self._run_chain = tf.function(self._sample_chain)
+
+    def _sample_chain(self, num_samples, num_burnin, init_state):
+        samples, (is_accepted, results) = tfp.mcmc.sample_chain(
+            num_results=num_samples,
+            num_burnin_steps=num_burnin,
+            current_state=init_state,
+            kernel=self.kernel,
+            trace_fn=lambda _, pkr: (pkr.is_accepted, pkr.accepted_results))
+
+        sample_mean = tf.reduce_mean(samples)
+        sample_stddev = tf.math.reduce_std(samples)
+        is_accepted = tf.reduce_mean(tf.cast(is_accepted, dtype=tf.float32))
+        return samples, sample_mean, sample_stddev, is_accepted, results
 
     def run_hmc(self, num_samples, num_burnin, init_state=None):
         """
         Run the HMC optimization.
 
+        The chain runner is a tf.function built once per HMC instance, so repeated
+        run_hmc calls with the same state shape reuse the compiled trace instead of
+        recompiling; the sample counts are passed in as tensors for the same reason.
+
         Args:
             - num_samples (int): number of optimization steps
             - num_burnin (int): number of burn in steps
@@ -233,20 +305,9 @@ class HMC(object):
             - (tuple): a tuple containing information about the states, acceptance rates, and results
         """
         if init_state is None:
-            init_state = tf.random.uniform(shape=[self.num_vars], minval=-2**(self.precision - 1), maxval=2**(self.precision - 1))
-            
-        @tf.function
-        def run_chain():
-            samples, (is_accepted, results) = tfp.mcmc.sample_chain(
-                num_results=num_samples,
-                num_burnin_steps=num_burnin,
-                current_state=init_state,
-                kernel=self.kernel,
-                trace_fn=lambda _, pkr: (pkr.is_accepted, pkr.accepted_results))
-
-            sample_mean = tf.reduce_mean(samples)
-            sample_stddev = tf.math.reduce_std(samples)
-            is_accepted = tf.reduce_mean(tf.cast(is_accepted, dtype=tf.float32))
-            return samples, sample_mean, sample_stddev, is_accepted, results
-
-        return run_chain()
+            if self.num_chains == 1:
+                init_state = tf.random.uniform(shape=[self.num_vars], minval=-2**(self.precision - 1), maxval=2**(self.precision - 1))
+            else:
+                init_state = tf.random.uniform(shape=[self.num_chains, self.num_vars], minval=-2**(self.precision - 1), maxval=2**(self.precision - 1))
+
+        return self._run_chain(tf.convert_to_tensor(num_samples), tf.convert_to_tensor(num_burnin), init_state)
@@ -8,6 +8,7 @@ import tensorflow_probability as tfp
 import cirq
 import sympy
 import collections
+import functools
 import random
 
 import matplotlib.pyplot as plt
@@ -18,6 +19,60 @@ from cv_utils import domain_float_tf, domain_bin_tf
 
 RWResult = collections.namedtuple("RWResult", ['target_log_prob', 'wfs', 'log_acceptance_correction'])
 
+@functools.lru_cache(maxsize=8)
+def generate_circuits(target_log_prob_fn, r, num_vars, precision):
+    """
+    Generate the trotterized circuit and all intermediate circuits for the given problem shape.
+
+    Cached on (target_log_prob_fn, r, num_vars, precision) so that repeated kernel
+    instantiations reuse the symbolic circuits instead of rebuilding them. Reuse
+    requires passing the same callable object (chain restarts, re-instantiating a
+    kernel for the same problem); a sweep that builds a fresh closure per point
+    misses every time, which is why the cache is bounded. The symbols are created
+    inside the cached call so the returned circuits and parameter list stay
+    consistent with each other.
+
+    Args:
+        - target_log_prob_fn (Callable): the function to optimize
+        - r (int): the number of trotter repetitions
+        - num_vars (int): the number of variables that the function is of
+        - precision (int): number of qubits to use to represent each variable
+
+    Returns:
+        - (list): all intermediate trotterized circuits
+        - (list): the symbols used in the trotterized circuits
+    """
+    qubits = [[cirq.GridQubit(i, j) for j in range(precision)] for i in range(num_vars)]
+    eta = sympy.symbols('eta')
+    lam = sympy.symbols('lam')
+    xs = sympy.symbols('xs0:%d'%(num_vars*precision))
+    circuit_list = []
+    flat_qubits = [qubit for qs in qubits for qubit in qs]
+    circuit = cirq.Circuit(cirq.Moment(cirq.X(qubit)**xs[k] for k, qubit in enumerate(flat_qubits)))
+    circuit_list.append(circuit)
+    # Fragments reused across trotter steps: they depend only on the qubit layout
+    # and the shared eta/lam symbols, not on the step index
+    potential = tfq.util.exponential(operators = [target_log_prob_fn([PositionOp(qs) for qs in qubits]).op], coefficients = [eta])
+    qft = [centeredQFT(qs) for qs in qubits]
+    iqft = [centeredQFT(qs, inverse=True) for qs in qubits]
+    # The per-register momentum terms act on disjoint qubits, so their exponentials
+    # factor and one summed operator yields the same unitary as one sub-circuit each
+    momentum_sq = sum(((1/2) * MomentumOp(qs).op ** 2 for qs in qubits), cirq.PauliSum())
+    kinetic = tfq.util.exponential(operators = [momentum_sq], coefficients = [lam])
+    x_first = [cirq.X(qs[0]) for qs in qubits]
+    for _ in range(r):
+        circuit += potential
+        circuit += qft
+        circuit += kinetic
+        circuit += x_first
+        circuit += iqft
+        circuit_list.append(circuit)
+        circuit += qft
+        circuit += x_first
+        circuit += iqft
+
+    return circuit_list, list(xs) + [eta] + [lam]
+
 class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
     """
     The core transition kernel for the QDHMC algorithm.
@@ -30,6 +85,12 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
         - sample (tf.keras.layers.Layer): the TFQ layer for sampling from circuits
         - state (tf.keras.layers.Layer): the TFQ layer for getting the state from circuits
         - all_circuits (list): the list of all intermediate circuits
+        - _zero_wfs (tf.Tensor): cached all-zero waveform history used to bootstrap results
+        - _symbol_values (tf.Variable): persistent buffer holding the current symbol values,
+            written once per step and shared by the sample and state calls
+        - wfs_dtype (tf.DType): dtype used to archive the intermediate probability vectors
+        - record_wfs (bool): whether the intermediate wavefunctions are simulated and
+            archived each step; when False the wfs slot holds the cached zero tensor
         - trotterized_circuit (cirq.Circuit): the static circuit parameterized to enable random trotterization.
             This is generated up front (as opposed to on the fly) to improve speed and to integrate with TF 
             autographing substantially easier.
@@ -40,7 +101,7 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
         - lam_sig (float): the standard deviation of the lambda parameter
     """
 
-    def __init__(self, target_log_prob, precision, t, r, num_vars):
+    def __init__(self, target_log_prob, precision, t, r, num_vars, wfs_dtype=tf.float32, record_wfs=False):
         """
         Initialize member variables.
 
@@ -50,6 +111,13 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
             - t (float): the trotterized time to simualte
             - r (int): the number of trotter repetitions to do
             - num_vars (int): the number of variables that the function is of
+            - wfs_dtype (tf.DType, optional): dtype used to archive the intermediate
+                probability vectors; tf.bfloat16 or tf.float16 halve the bytes stored
+                per step (the simulation itself stays complex64)
+            - record_wfs (bool, optional): whether to simulate and archive the
+                intermediate wavefunctions each step; leave False unless the trace is
+                actually going to be plotted, as recording costs r+1 extra State
+                simulations per step
 
         Returns:
             - None
@@ -64,12 +132,13 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
         self.sample = tfq.layers.Sample()
         self.state = tfq.layers.State()
         self.qubits = [[cirq.GridQubit(i, j) for j in range(self.precision)] for i in range(num_vars)]
-        eta = sympy.symbols('eta')
-        lam = sympy.symbols('lam')
-        xs = sympy.symbols('xs0:%d'%(num_vars*precision))
-        self.all_circuits = self.generate_circuits(self.r, xs, eta, lam)
+        self.all_circuits, self.params = generate_circuits(target_log_prob, self.r, self.num_vars, self.precision)
         self.trotterized_circuit = self.all_circuits[-1]
-        self.params = list(xs) + [eta] + [lam]
+        self.wfs_dtype = wfs_dtype
+        self.record_wfs = record_wfs
+        self._zero_wfs = tf.zeros([self.r + 1, 2**(self.num_vars * self.precision)], dtype=wfs_dtype)
+        self.dtype = tf.float32
+        self._symbol_values = tf.Variable(tf.zeros([1, num_vars * precision + 2]), trainable=False, name="symbol_values")
         self.eta_mu = 0
         self.lam_mu = 0
         self.eta_sig = 1
@@ -99,48 +168,26 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
     def is_calibrated(self):
         return False
 
-    def generate_circuits(self, r, xs, eta, lam):
-        """
-        Generate the trotterized circuit.
-
-        Args:
-            - r (int): the number of trotter repetitions
-            - xs (list): the parameters to initialize a given bitstring
-            - eta (list): the parameters representing eta
-            - lam (list): the parameters representing lambda
-
-        Returns:
-            - (list): all intermediate trotterized circuits
-        """
-        circuit_list = []
-        circuit = cirq.Circuit()
-        for i, qubits in enumerate(self.qubits):
-            for j, qubit in enumerate(qubits):
-                circuit += cirq.X(qubit)**xs[i * self.precision + j]
-        circuit_list.append(circuit)
-        for _ in range(r):
-            circuit += tfq.util.exponential(operators = [self.target_log_prob_fn([PositionOp(qubits) for qubits in self.qubits]).op], coefficients = [eta])
-            circuit += [centeredQFT(qubits) for qubits in self.qubits]
-            circuit += [tfq.util.exponential(operators = [(1/2) * MomentumOp(qubits).op ** 2], coefficients = [lam]) for qubits in self.qubits]
-            circuit += [cirq.X(qubits[0]) for qubits in self.qubits]
-            circuit += [centeredQFT(qubits, inverse=True) for qubits in self.qubits]
-            circuit_list.append(circuit)
-            circuit += [centeredQFT(qubits) for qubits in self.qubits]
-            circuit += [cirq.X(qubits[0]) for qubits in self.qubits]
-            circuit += [centeredQFT(qubits, inverse=True) for qubits in self.qubits]
-
-        return circuit_list
-
+    @tf.function
     def one_step(self, current_state, previous_kernel_results, seed=None):
         """
         Generate the next proposal.
 
-        Randomly selects the eta and lambda parameters and parameterizes the trotterized 
+        Randomly selects the eta and lambda parameters and parameterizes the trotterized
         circuit with them. Converts the current state and encodes it to the circuit. The
         circuit is then simulated and the output is converted back into a float and returned.
 
         The unusual formatting and usage of certain functions is to ensure it is compatible with
-        all TF graphing techniques.
+        all TF graphing techniques. The whole step is wrapped in tf.function so the per-op
+        dispatch overhead collapses into a single graph call; traces are cached per state
+        shape/dtype. XLA (jit_compile=True) is not used because the TFQ simulation ops do
+        not provide XLA kernels.
+
+        The target log-prob is evaluated exactly once per proposal. The evaluation cannot
+        be recovered from the trotterized evolution itself: the circuit only embeds the
+        target as a symbolic operator, and the Metropolis-Hastings correction needs the
+        exact log-prob at the sampled point, not an expectation under the proposal
+        wavefunction.
 
         Additionally saves the wavefunction for all intermediate trotterized circuits. 
 
@@ -161,30 +208,45 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
         
         bin_vals = domain_bin_tf(current_state, precision=self.precision)
         bin_vals = tf.reshape(bin_vals, [bin_vals.shape[0] * bin_vals.shape[1]])
-        bin_vals = tf.cast(bin_vals, tf.float32)
+        bin_vals = tf.cast(bin_vals, self.dtype)
 
-        values = tf.concat([bin_vals, eta, lam], axis=0)
+        # Write the symbol values once per step; every TFQ layer call below reads
+        # the same persistent buffer instead of being fed a fresh tensor
+        self._symbol_values.assign(tf.expand_dims(tf.concat([bin_vals, eta, lam], axis=0), 0))
 
         circuit_output = self.sample(self.trotterized_circuit, \
-            symbol_names=self.params, symbol_values=[values], repetitions=1).to_tensor()[0][0]
-        bitstrings = tf.convert_to_tensor([circuit_output[i * self.precision : i * self.precision + self.precision] for i in range(self.num_vars)], dtype=tf.float32)
-
-        next_wfs = []
-        for intermediate_circuit in self.all_circuits:
-            final_state = self.state(intermediate_circuit, symbol_names=self.params, symbol_values=[values]).to_tensor()
-            wf = tf.reshape(tf.math.real(tf.math.conj(final_state) * final_state)[0], [2**(self.num_vars*self.precision)])
-            next_wfs.append(wf)
-        next_wfs = tf.convert_to_tensor(next_wfs, dtype=tf.float32)
+            symbol_names=self.params, symbol_values=self._symbol_values, repetitions=1).to_tensor()
+        circuit_output = tf.ensure_shape(circuit_output, [1, 1, self.num_vars * self.precision])
+        circuit_output = tf.squeeze(circuit_output, axis=[0, 1])
+        bitstrings = tf.reshape(tf.cast(circuit_output, self.dtype), [self.num_vars, self.precision])
+
+        if self.record_wfs:
+            # The waveform history comes out of the one batched State call below, so no
+            # per-circuit accumulator (Python list or tf.TensorArray) is needed and the
+            # step stays traceable end to end
+            batched_values = tf.tile(self._symbol_values, [len(self.all_circuits), 1])
+            final_states = self.state(self.all_circuits, symbol_names=self.params, symbol_values=batched_values).to_tensor()
+            probs = tf.square(tf.math.real(final_states)) + tf.square(tf.math.imag(final_states))
+            next_wfs = tf.reshape(probs, [len(self.all_circuits), 2**(self.num_vars*self.precision)])
+            next_wfs = tf.cast(next_wfs, self.wfs_dtype)
+        else:
+            next_wfs = self._zero_wfs
 
         next_state_list = domain_float_tf(bitstrings, self.precision)
         next_state = tf.reshape(next_state_list, current_state.shape)
-        next_state = tf.cast(next_state, dtype=tf.float32)
+        # Trace-time guard: the cast (and its copy) is only emitted when the chain
+        # state dtype actually differs from the kernel dtype
+        if next_state.dtype != self.dtype:
+            next_state = tf.cast(next_state, dtype=self.dtype)
 
         next_target_log_prob = self.target_log_prob_fn(next_state)
         
-        new_kernel_results = previous_kernel_results._replace(
+        # Construct the namedtuple directly rather than via _replace, which routes
+        # every update through a kwargs dict on each of the millions of MCMC steps
+        new_kernel_results = RWResult(
             target_log_prob = next_target_log_prob,
-            wfs = next_wfs)
+            wfs = next_wfs,
+            log_acceptance_correction = previous_kernel_results.log_acceptance_correction)
 
         return next_state, new_kernel_results
 
@@ -200,8 +262,8 @@ class QDHMCKernel(tfp.python.mcmc.kernel.TransitionKernel):
         """
         kernel_results = RWResult(
             target_log_prob = self.target_log_prob_fn(init_state),
-            wfs = tf.convert_to_tensor([[0.0]*(2**(self.num_vars*self.precision))]*(self.r + 1), dtype=tf.float32),
-            log_acceptance_correction = tf.convert_to_tensor(0.0, dtype=tf.float32)
+            wfs = self._zero_wfs,
+            log_acceptance_correction = tf.zeros(tf.shape(init_state)[:-1], dtype=tf.float32)
         )
         return kernel_results
 
@@ -216,7 +278,7 @@ class HMC(object):
         - kernel (mcmc object): type of optimization to be used
     """
 
-    def __init__(self, target_log_prob, num_vars, precision, kernel_type="classical", step_size=1.0, steps=3, t=None, r=None):
+    def __init__(self, target_log_prob, num_vars, precision, kernel_type="classical", step_size=1.0, steps=3, t=None, r=None, record_wfs=True, wfs_dtype=tf.float32):
         """
         Initialize member variables.
 
@@ -229,6 +291,10 @@ class HMC(object):
             - steps (int): the number of leapfrog steps for the classical integration
             - t (float): the trotterized time to simualte
             - r (int): the number of trotter repetitions to do
+            - record_wfs (bool): whether to archive the intermediate wavefunctions each
+                step; defaults to True here since this wrapper exists for plotting
+            - wfs_dtype (tf.DType): dtype used to archive the intermediate probability
+                vectors; tf.bfloat16 or tf.float16 halve the bytes stored per step
 
         Returns:
             - None
@@ -236,14 +302,32 @@ class HMC(object):
         self.precision = precision
         self.num_vars = num_vars
         if kernel_type != "classical":
-            self.kernel = tfp.mcmc.MetropolisHastings(QDHMCKernel(target_log_prob, precision, t, r, num_vars))
+            self.kernel = tfp.mcmc.MetropolisHastings(QDHMCKernel(target_log_prob, precision, t, r, num_vars, wfs_dtype=wfs_dtype, record_wfs=record_wfs))
         else:
             self.kernel = tfp.mcmc.HamiltonianMonteCarlo(target_log_prob_fn=target_log_prob, num_leapfrog_steps=steps, step_size=step_size)
+        self._run_chain = tf.function(self._sample_chain)
+
+    def _sample_chain(self, num_samples, num_burnin, init_state):
+        samples, (is_accepted, results) = tfp.mcmc.sample_chain(
+            num_results=num_samples,
+            num_burnin_steps=num_burnin,
+            current_state=init_state,
+            kernel=self.kernel,
+            trace_fn=lambda _, pkr: (pkr.is_accepted, pkr.accepted_results))
+
+        sample_mean = tf.reduce_mean(samples)
+        sample_stddev = tf.math.reduce_std(samples)
+        is_accepted = tf.reduce_mean(tf.cast(is_accepted, dtype=tf.float32))
+        return samples, sample_mean, sample_stddev, is_accepted, results
 
     def run_hmc(self, num_samples, num_burnin, init_state=None):
         """
         Run the HMC optimization.
 
+        The chain runner is a tf.function built once per HMC instance, so repeated
+        run_hmc calls with the same state shape reuse the compiled trace instead of
+        recompiling; the sample counts are passed in as tensors for the same reason.
+
         Args:
             - num_samples (int): number of optimization steps
             - num_burnin (int): number of burn in steps
@@ -254,19 +338,5 @@ class HMC(object):
         """
         if init_state is None:
             init_state = tf.random.uniform(shape=[self.num_vars], minval=-2**(self.precision - 1), maxval=2**(self.precision - 1))
-            
-        @tf.function
-        def run_chain():
-            samples, (is_accepted, results) = tfp.mcmc.sample_chain(
-                num_results=num_samples,
-                num_burnin_steps=num_burnin,
-                current_state=init_state,
-                kernel=self.kernel,
-                trace_fn=lambda _, pkr: (pkr.is_accepted, pkr.accepted_results))
-
-            sample_mean = tf.reduce_mean(samples)
-            sample_stddev = tf.math.reduce_std(samples)
-            is_accepted = tf.reduce_mean(tf.cast(is_accepted, dtype=tf.float32))
-            return samples, sample_mean, sample_stddev, is_accepted, results
-
-        return run_chain()
+
+        return self._run_chain(tf.convert_to_tensor(num_samples), tf.convert_to_tensor(num_burnin), init_state)